@@ -2,32 +2,88 @@
 Library Management System - Main Application Entry Point
 """
 from flask import Flask, render_template, redirect, url_for, session
+from flask.logging import default_handler
 from flask_pymongo import PyMongo
+from pymongo.errors import PyMongoError
+from jinja2 import FileSystemBytecodeCache
 from datetime import timedelta
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import logging
 import os
+import queue
+from types import SimpleNamespace
 from config import Config
+from extensions import cache
+from models.indexes import ensure_indexes
+from models.utils import JSON_CODEC_OPTIONS
+from routes import register_blueprints
+
+
+def configure_logging(app):
+    """Route app and model logs through a queue so handler I/O runs off the request thread"""
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(name)s: %(message)s'))
+    
+    log_queue = queue.SimpleQueue()
+    
+    def start_listener():
+        listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+    
+    start_listener()
+    # Forked workers (gunicorn --preload) inherit the queue but not the listener
+    # thread, so each child starts its own or its records would never be written
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=start_listener)
+    
+    queue_handler = QueueHandler(log_queue)
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(queue_handler)
+    logging.getLogger('models').addHandler(queue_handler)
 
-# Import blueprints
-from routes.auth import auth_bp
-from routes.admin import admin_bp
-from routes.user import user_bp
-from routes.books import books_bp
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
+configure_logging(app)
+
+# Reuse compiled template bytecode instead of re-parsing templates in every worker
+if Config.JINJA_BYTECODE_CACHE_DIR:
+    os.makedirs(Config.JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(Config.JINJA_BYTECODE_CACHE_DIR)
 
-# Initialize MongoDB
-mongo = PyMongo(app)
+# Initialize MongoDB with an explicitly sized connection pool
+mongo = PyMongo(app, **Config.MONGO_OPTIONS)
 
 # Make mongo accessible to blueprints
 app.mongo = mongo
 
+# Read-only handle for the JSON API: ids arrive as strings, ready to serialise
+app.mongo_json = SimpleNamespace(db=mongo.cx.get_database(mongo.db.name, codec_options=JSON_CODEC_OPTIONS))
+
+# Initialize cache
+cache.init_app(app)
+
+# Server-side sessions when Redis is configured; otherwise the signed cookie is used
+if Config.SESSION_REDIS_URL:
+    from flask_session import Session
+    from redis import Redis
+    
+    app.config.update(
+        SESSION_TYPE='redis',
+        SESSION_REDIS=Redis.from_url(Config.SESSION_REDIS_URL),
+        SESSION_USE_SIGNER=True
+    )
+    Session(app)
+
+# Create indexes for better performance (idempotent, also runs under gunicorn/uwsgi)
+with app.app_context():
+    ensure_indexes(mongo)
+
 # Register blueprints
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(admin_bp, url_prefix='/admin')
-app.register_blueprint(user_bp, url_prefix='/user')
-app.register_blueprint(books_bp, url_prefix='/books')
+register_blueprints(app)
 
 
 @app.route('/')
@@ -59,6 +115,13 @@ def internal_error(error):
     return render_template('500.html'), 500
 
 
+@app.errorhandler(PyMongoError)
+def database_error(error):
+    """Handle database errors raised from the models"""
+    app.logger.exception("Database error")
+    return render_template('500.html'), 500
+
+
 @app.context_processor
 def inject_user():
     """Make user info available to all templates"""
@@ -70,23 +133,4 @@ def inject_user():
 
 
 if __name__ == '__main__':
-    # Create indexes for better performance
-    with app.app_context():
-        # Users collection indexes
-        mongo.db.users.create_index('email', unique=True)
-        mongo.db.users.create_index('username', unique=True)
-        
-        # Books collection indexes
-        mongo.db.books.create_index('isbn', unique=True)
-        mongo.db.books.create_index('title')
-        mongo.db.books.create_index('author')
-        mongo.db.books.create_index('category')
-        
-        # Transactions collection indexes
-        mongo.db.transactions.create_index('user_id')
-        mongo.db.transactions.create_index('book_id')
-        mongo.db.transactions.create_index('issue_date')
-        mongo.db.transactions.create_index('status')
-
-    
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -14,8 +14,60 @@ class Config:
     # MongoDB configuration
     MONGO_URI = os.environ.get('MONGO_URI') or 'mongodb://localhost:27017/library_db'
     
-    # Session configuration
-    SESSION_TYPE = 'filesystem'
+    # MongoClient connection pool settings, shared by every request in a worker
+    MONGO_OPTIONS = {
+        'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+        'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', 10)),
+        'waitQueueTimeoutMS': 2500,
+        'socketTimeoutMS': 20000,
+        'serverSelectionTimeoutMS': 5000
+    }
+    
+    # Request threads per worker process (match gunicorn --threads or the server's pool)
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+    # Most queries one handler runs side by side (the admin dashboard runs five)
+    QUERY_FAN_OUT = 5
+    # Shared query pool size; every request thread can fan out at once without queueing
+    QUERY_EXECUTOR_WORKERS = int(os.environ.get('QUERY_EXECUTOR_WORKERS', WEB_THREADS * QUERY_FAN_OUT))
+    
+    # Cache configuration (per-process cache for read-mostly data)
+    # Set CACHE_TYPE=RedisCache and CACHE_REDIS_URL to share the cache between workers
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'SimpleCache'
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_DEFAULT_TIMEOUT = 60
+    # Category lists are invalidated on every book write, so they can live longer;
+    # the timeout only bounds staleness in other worker processes
+    CATEGORIES_CACHE_TIMEOUT = int(os.environ.get('CATEGORIES_CACHE_TIMEOUT', 300))
+    # Seconds a book search results page is reused
+    SEARCH_CACHE_TIMEOUT = int(os.environ.get('SEARCH_CACHE_TIMEOUT', 60))
+    # Seconds the rendered browse books grid is reused
+    BROWSE_CACHE_TIMEOUT = int(os.environ.get('BROWSE_CACHE_TIMEOUT', 120))
+    # Seconds the /books/api/statistics payload is served from cache
+    STATISTICS_CACHE_TIMEOUT = int(os.environ.get('STATISTICS_CACHE_TIMEOUT', 30))
+    # Seconds before the available copies counter is recomputed from the books,
+    # correcting any drift from writes that raced a rebuild or bypassed the app
+    COUNTER_RECONCILE_INTERVAL = int(os.environ.get('COUNTER_RECONCILE_INTERVAL', 300))
+    
+    # Seconds a filtered pagination count may be reused before it is recounted
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', 10))
+    # Longest a pagination count may run before a capped count is used instead
+    COUNT_MAX_TIME_MS = int(os.environ.get('COUNT_MAX_TIME_MS', 500))
+    # Most matches a capped count looks for once the exact count has timed out
+    COUNT_FALLBACK_LIMIT = int(os.environ.get('COUNT_FALLBACK_LIMIT', 1000))
+    
+    # Directory for compiled Jinja2 template bytecode (None uses a per-user temp dir)
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR')
+    
+    # Password hashing: 'bcrypt', or any werkzeug method string such as
+    # 'pbkdf2:sha256:1000' for fast throwaway hashes in development and tests
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'bcrypt'
+    
+    # Password hashing work factor (bcrypt log rounds); tune to the server's CPU
+    BCRYPT_COST = int(os.environ.get('BCRYPT_COST', 12))
+    
+    # Session configuration (Flask's signed-cookie session; the payload is only a few ids)
+    # Set SESSION_REDIS_URL to keep sessions in Redis and send only a signed session id
+    SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL')
     PERMANENT_SESSION_LIFETIME = timedelta(hours=2)
     SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
     SESSION_COOKIE_HTTPONLY = True
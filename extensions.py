@@ -0,0 +1,14 @@
+"""
+Flask extensions shared between the app and the models
+"""
+from flask_caching import Cache
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+# Bound to the app in app.py; models use it for read-mostly lookups
+cache = Cache()
+
+# Runs independent page queries side by side (pymongo releases the GIL on I/O);
+# sized for every request thread fanning out at once, see QUERY_EXECUTOR_WORKERS
+query_executor = ThreadPoolExecutor(max_workers=Config.QUERY_EXECUTOR_WORKERS,
+                                    thread_name_prefix='query')
@@ -2,20 +2,23 @@
 Sample Data Initialization Script
 Populates the database with sample books, users, and categories
 """
-from pymongo import MongoClient
+from pymongo import MongoClient, DeleteMany, InsertOne
 from werkzeug.security import generate_password_hash
 from datetime import datetime, timedelta
 import random
 
-# Connect to MongoDB
-client = MongoClient('mongodb://localhost:27017/')
+# Connect to MongoDB (a single small pool is plenty for this one-off script)
+client = MongoClient('mongodb://localhost:27017/', maxPoolSize=20)
 db = client['library_db']
 
-# Clear existing data
+# Explicit hash method so the per-password cost does not change with werkzeug defaults
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:100000'
+
+# Clear existing transactions (users and books are replaced in bulk below)
 print("Clearing existing data...")
-db.users.delete_many({})
-db.books.delete_many({})
 db.transactions.delete_many({})
+# Counters are rebuilt from the new books the first time they are read
+db.counters.delete_many({})
 
 # Create indexes
 print("Creating indexes...")
@@ -28,7 +31,7 @@ print("Creating admin user...")
 admin = {
     'username': 'admin',
     'email': 'admin@library.com',
-    'password': generate_password_hash('admin123'),
+    'password': generate_password_hash('admin123', method=PASSWORD_HASH_METHOD),
     'full_name': 'System Administrator',
     'role': 'admin',
     'phone': '+91-9876543210',
@@ -39,7 +42,6 @@ admin = {
     'books_issued': 0,
     'total_fines': 0.0
 }
-db.users.insert_one(admin)
 
 # Create sample users
 print("Creating sample users...")
@@ -47,7 +49,7 @@ sample_users = [
     {
         'username': 'mouneesh',
         'email': 'mouneesh@example.com',
-        'password': generate_password_hash('123456'),
+        'password': generate_password_hash('123456', method=PASSWORD_HASH_METHOD),
         'full_name': 'Mouneesh',
         'role': 'user',
         'phone': '+91-9876543211',
@@ -61,7 +63,7 @@ sample_users = [
     {
         'username': 'jane_smith',
         'email': 'jane@example.com',
-        'password': generate_password_hash('password123'),
+        'password': generate_password_hash('password123', method=PASSWORD_HASH_METHOD),
         'full_name': 'Jane Smith',
         'role': 'user',
         'phone': '+91-9876543212',
@@ -75,7 +77,7 @@ sample_users = [
     {
         'username': 'bob_wilson',
         'email': 'bob@example.com',
-        'password': generate_password_hash('password123'),
+        'password': generate_password_hash('password123', method=PASSWORD_HASH_METHOD),
         'full_name': 'Bob Wilson',
         'role': 'user',
         'phone': '+91-9876543213',
@@ -87,7 +89,10 @@ sample_users = [
         'total_fines': 0.0
     }
 ]
-db.users.insert_many(sample_users)
+
+# Replace all users; the ordered bulk runs the delete before the inserts
+# (pymongo still sends them as two commands, one per operation type)
+db.users.bulk_write([DeleteMany({})] + [InsertOne(user) for user in [admin] + sample_users])
 
 # Create sample books
 print("Creating sample books...")
@@ -221,7 +226,8 @@ sample_books = [
         'total_issued': 0
     }
 ]
-db.books.insert_many(sample_books)
+# Replace all books the same way
+db.books.bulk_write([DeleteMany({})] + [InsertOne(book) for book in sample_books])
 
 print("\n" + "="*60)
 print("Sample data created successfully!")
@@ -234,13 +240,17 @@ print("\nSample User Accounts:")
 print("  Username: john_doe / jane_smith / bob_wilson")
 print("  Password: password123")
 print("\nDatabase Statistics:")
-print(f"  Total Users: {db.users.count_documents({})}")
-print(f"  Total Books: {db.books.count_documents({})}")
-print(f"  Total Categories: {len(db.books.distinct('category'))}")
+print(f"  Total Users: {db.users.estimated_document_count()}")
+print(f"  Total Books: {db.books.estimated_document_count()}")
+category_counts = list(db.books.aggregate([
+    {'$match': {'is_active': True}},
+    {'$group': {'_id': '$category', 'count': {'$sum': 1}}},
+    {'$sort': {'_id': 1}}
+]))
+print(f"  Total Categories: {len(category_counts)}")
 print("\nCategories:")
-for category in sorted(db.books.distinct('category')):
-    count = db.books.count_documents({'category': category})
-    print(f"  - {category}: {count} books")
+for category in category_counts:
+    print(f"  - {category['_id']}: {category['count']} books")
 print("\n" + "="*60)
 print("\nYou can now start the application with: python app.py")
 print("="*60 + "\n")
\ No newline at end of file
@@ -4,5 +4,6 @@ Models package initialization
 from .user import User
 from .book import Book
 from .transaction import Transaction
+from .indexes import ensure_indexes
 
-__all__ = ['User', 'Book', 'Transaction']
\ No newline at end of file
+__all__ = ['User', 'Book', 'Transaction', 'ensure_indexes']
\ No newline at end of file
@@ -2,7 +2,151 @@
 Book Model - Handles book data structure and operations
 """
 from datetime import datetime
-from bson.objectid import ObjectId
+from models.utils import to_object_id, cached_count, codec_tag
+from models.counters import AVAILABLE_BOOKS, adjust_counter, read_counter, store_counter
+from pymongo import ReturnDocument
+from extensions import cache
+from config import Config
+from functools import lru_cache
+import hashlib
+import re
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+_CATEGORIES_CACHE_KEY = 'books:categories'
+# Bumped on every book write; cached search pages from older generations are never read again
+_SEARCH_GENERATION_KEY = 'books:search:generation'
+
+# A complete ISBN-10/13, with or without hyphens
+_ISBN_RE = re.compile(r'^[0-9\-Xx]{10,17}$')
+# Queries that could be (part of) an ISBN; also matched as text, since titles like "1984" look the same
+_ISBN_LIKE_RE = re.compile(r'^[0-9Xx\-]+$')
+
+
+# Books that can be issued right now
+_AVAILABLE_FILTER = {'is_active': True, 'available_quantity': {'$gt': 0}}
+
+# Default fields for list/API views (book cards and tables); skips description etc.
+# List methods take a fields projection to narrow this further
+_LIST_PROJECTION = {
+    'title': 1,
+    'author': 1,
+    'isbn': 1,
+    'category': 1,
+    'quantity': 1,
+    'available_quantity': 1,
+    'cover_image': 1
+}
+
+
+@lru_cache(maxsize=256)
+def _isbn_prefix_pattern(query):
+    """Escaped, anchored ISBN prefix pattern, compiled once per distinct query"""
+    return re.compile('^' + re.escape(query))
+
+
+def _search_filter(query='', category='', active_only=True):
+    """Build the books filter for a search, using the text index for free-text queries"""
+    filter_query = {}
+    if active_only:
+        filter_query['is_active'] = True
+    
+    if query:
+        text_match = {'$text': {'$search': query}}
+        if _ISBN_LIKE_RE.match(query):
+            # ISBN lookups: an anchored prefix regex can walk the isbn index;
+            # both branches are indexed, so $text is allowed inside the $or
+            filter_query['$or'] = [text_match, {'isbn': _isbn_prefix_pattern(query)}]
+        else:
+            filter_query.update(text_match)
+    
+    if category:
+        filter_query['category'] = category
+    
+    return filter_query
+
+
+def _find_exact_isbn(mongo, query, category=''):
+    """Point lookup on the unique isbn index when the query is a complete ISBN"""
+    if not _ISBN_RE.match(query):
+        return None
+    
+    exact_query = {'isbn': query, 'is_active': True}
+    if category:
+        exact_query['category'] = category
+    return mongo.db.books.find_one(exact_query, _LIST_PROJECTION)
+
+
+def _generation_cache_key(prefix, *parts):
+    """Cache key for data derived from books, scoped to the current book generation"""
+    generation = cache.get(_SEARCH_GENERATION_KEY) or 0
+    digest = hashlib.sha1('|'.join(str(part) for part in (generation, *parts)).encode('utf-8')).hexdigest()
+    return f'{prefix}:{digest}'
+
+
+def _search_cache_key(mongo, kind, query, category, skip, limit):
+    """Cache key for a search page, scoped to the current search generation
+    
+    Includes the handle's decoding, so pages read through mongo_json (string ids)
+    and through mongo (ObjectIds) are cached separately.
+    """
+    return _generation_cache_key('books:search', codec_tag(mongo), kind, query, category, skip, limit)
+
+
+def _search_stages(query, category, skip, limit):
+    """Match, rank and page stages for a search; returns (match stages, page stages)"""
+    filter_query = _search_filter(query, category)
+    match = [{'$match': filter_query}]
+    
+    if '$text' in filter_query:
+        # Rank free-text matches by relevance
+        match.append({'$addFields': {'score': {'$meta': 'textScore'}}})
+        sort = {'score': -1}
+    else:
+        sort = {'title': 1}
+    
+    page = [
+        {'$sort': sort},
+        {'$skip': skip},
+        {'$limit': limit},
+        {'$project': {**_LIST_PROJECTION, 'score': 1}}
+    ]
+    return match, page
+
+
+def _search_page(mongo, query, category, skip, limit):
+    """Run a search page without counting the other matches"""
+    if query and not skip:
+        hit = _find_exact_isbn(mongo, query, category)
+        if hit:
+            return [hit]
+    
+    match, page = _search_stages(query, category, skip, limit)
+    return list(mongo.db.books.aggregate(match + page))
+
+
+def _search_paged(mongo, query, category, skip, limit):
+    """Run a search page and its total count in one $facet aggregation"""
+    if query and not skip:
+        hit = _find_exact_isbn(mongo, query, category)
+        if hit:
+            return [hit], 1
+    
+    match, page = _search_stages(query, category, skip, limit)
+    pipeline = match + [{'$facet': {
+        'books': page,
+        'total': [{'$count': 'n'}]
+    }}]
+    
+    result = next(mongo.db.books.aggregate(pipeline), None)
+    if not result:
+        return [], 0
+    total = result['total'][0]['n'] if result['total'] else 0
+    return result['books'], total
 
 
 class Book:
@@ -14,9 +158,10 @@ class Book:
         """Create a new book in the database"""
         try:
             # Check if ISBN already exists
-            if mongo.db.books.find_one({'isbn': isbn}):
+            if mongo.db.books.find_one({'isbn': isbn}, {'_id': 1}):
                 return None
             
+            now = datetime.utcnow()
             book_data = {
                 'title': title,
                 'author': author,
@@ -28,8 +173,8 @@ class Book:
                 'available_quantity': int(quantity),
                 'description': description,
                 'cover_image': cover_image or '/static/img/default-book.png',
-                'created_at': datetime.utcnow(),
-                'updated_at': datetime.utcnow(),
+                'created_at': now,
+                'updated_at': now,
                 'is_active': True,
                 'total_issued': 0,
                 'rating': 0.0,
@@ -37,18 +182,20 @@ class Book:
             }
             
             result = mongo.db.books.insert_one(book_data)
+            adjust_counter(mongo, AVAILABLE_BOOKS, book_data['available_quantity'])
+            Book.invalidate_caches()
             return result.inserted_id
-        except Exception as e:
-            print(f"Error creating book: {e}")
+        except Exception:
+            logger.exception("Error creating book")
             return None
     
     @staticmethod
-    def get_by_id(mongo, book_id):
-        """Get book by ID"""
+    def get_by_id(mongo, book_id, fields=None):
+        """Get book by ID (the full document unless a projection is given)"""
         try:
-            return mongo.db.books.find_one({'_id': ObjectId(book_id)})
-        except Exception as e:
-            print(f"Error getting book: {e}")
+            return mongo.db.books.find_one({'_id': to_object_id(book_id)}, fields)
+        except Exception:
+            logger.exception("Error getting book")
             return None
     
     @staticmethod
@@ -56,8 +203,8 @@ class Book:
         """Get book by ISBN"""
         try:
             return mongo.db.books.find_one({'isbn': isbn})
-        except Exception as e:
-            print(f"Error getting book: {e}")
+        except Exception:
+            logger.exception("Error getting book")
             return None
     
     @staticmethod
@@ -65,123 +212,255 @@ class Book:
         """Update book information"""
         try:
             update_data['updated_at'] = datetime.utcnow()
-            result = mongo.db.books.update_one(
-                {'_id': ObjectId(book_id)},
-                {'$set': update_data}
+            before = mongo.db.books.find_one_and_update(
+                {'_id': to_object_id(book_id)},
+                {'$set': update_data},
+                projection={'available_quantity': 1, 'is_active': 1},
+                return_document=ReturnDocument.BEFORE
             )
-            return result.modified_count > 0
-        except Exception as e:
-            print(f"Error updating book: {e}")
+            if before is None:
+                return False
+            
+            if 'available_quantity' in update_data and before.get('is_active', True):
+                adjust_counter(mongo, AVAILABLE_BOOKS,
+                               update_data['available_quantity'] - before.get('available_quantity', 0))
+            Book.invalidate_caches()
+            return True
+        except Exception:
+            logger.exception("Error updating book")
             return False
     
     @staticmethod
     def delete_book(mongo, book_id):
         """Soft delete book (set is_active to False)"""
         try:
-            result = mongo.db.books.update_one(
-                {'_id': ObjectId(book_id)},
-                {'$set': {'is_active': False, 'updated_at': datetime.utcnow()}}
+            before = mongo.db.books.find_one_and_update(
+                {'_id': to_object_id(book_id)},
+                {'$set': {'is_active': False, 'updated_at': datetime.utcnow()}},
+                projection={'available_quantity': 1, 'is_active': 1},
+                return_document=ReturnDocument.BEFORE
             )
-            return result.modified_count > 0
-        except Exception as e:
-            print(f"Error deleting book: {e}")
+            if before is None:
+                return False
+            
+            if before.get('is_active', True):
+                adjust_counter(mongo, AVAILABLE_BOOKS, -before.get('available_quantity', 0))
+            Book.invalidate_caches()
+            return True
+        except Exception:
+            logger.exception("Error deleting book")
             return False
     
     @staticmethod
     def search_books(mongo, query='', category='', skip=0, limit=12):
-        """Search books by title, author, or ISBN with optional category filter"""
+        """Search books by title, author, or ISBN with optional category filter
+        
+        For callers that need no total; skips counting. Pages are cached for
+        SEARCH_CACHE_TIMEOUT seconds and dropped on any book write.
+        """
+        key = _search_cache_key(mongo, 'page', query, category, skip, limit)
+        books = cache.get(key)
+        if books is not None:
+            return books
+        
         try:
-            filter_query = {'is_active': True}
-            
-            if query:
-                filter_query['$or'] = [
-                    {'title': {'$regex': query, '$options': 'i'}},
-                    {'author': {'$regex': query, '$options': 'i'}},
-                    {'isbn': {'$regex': query, '$options': 'i'}},
-                    {'description': {'$regex': query, '$options': 'i'}}
-                ]
-            
-            if category:
-                filter_query['category'] = category
+            books = _search_page(mongo, query, category, skip, limit)
+        except Exception:
+            logger.exception("Error searching books")
+            return []
+        
+        cache.set(key, books, timeout=Config.SEARCH_CACHE_TIMEOUT)
+        return books
+    
+    @staticmethod
+    def search_books_paged(mongo, query='', category='', skip=0, limit=12, cached=True):
+        """Search books and count all matches in one round trip; returns (books, total)
+        
+        Pages are cached for SEARCH_CACHE_TIMEOUT seconds and dropped on any book
+        write, but not on issue/return, so cached availability can lag; pass
+        cached=False where current stock matters (admin management).
+        """
+        if not cached:
+            try:
+                return _search_paged(mongo, query, category, skip, limit)
+            except Exception:
+                logger.exception("Error searching books")
+                return [], 0
+        
+        key = _search_cache_key(mongo, 'paged', query, category, skip, limit)
+        result = cache.get(key)
+        if result is not None:
+            return result
+        
+        try:
+            result = _search_paged(mongo, query, category, skip, limit)
+        except Exception:
+            logger.exception("Error searching books")
+            return [], 0
+        
+        cache.set(key, result, timeout=Config.SEARCH_CACHE_TIMEOUT)
+        return result
+    
+    @staticmethod
+    def get_all_books(mongo, skip=0, limit=12, active_only=True, fields=None):
+        """Get all books with pagination (lazy cursor, consume once)"""
+        try:
+            query = {}
+            if active_only:
+                query['is_active'] = True
             
-            books = mongo.db.books.find(filter_query).skip(skip).limit(limit).sort('title', 1)
-            return list(books)
-        except Exception as e:
-            print(f"Error searching books: {e}")
+            books = mongo.db.books.find(query, fields or _LIST_PROJECTION).skip(skip).limit(limit).sort('created_at', -1).batch_size(limit)
+            return books
+        except Exception:
+            logger.exception("Error getting books")
             return []
     
     @staticmethod
-    def get_all_books(mongo, skip=0, limit=12, active_only=True):
-        """Get all books with pagination"""
+    def get_books_after(mongo, after=None, limit=12, active_only=True, fields=None):
+        """Get a page of books, newest first, following the _id of the previous page's last book
+        
+        Walks the _id index from the cursor instead of skipping, so deep pages
+        cost the same as the first one.
+        """
         try:
             query = {}
             if active_only:
                 query['is_active'] = True
+            if after:
+                query['_id'] = {'$lt': to_object_id(after)}
             
-            books = mongo.db.books.find(query).skip(skip).limit(limit).sort('created_at', -1)
+            books = mongo.db.books.find(query, fields or _LIST_PROJECTION).sort('_id', -1).limit(limit).batch_size(limit)
             return list(books)
-        except Exception as e:
-            print(f"Error getting books: {e}")
+        except Exception:
+            logger.exception("Error getting books")
             return []
     
     @staticmethod
     def count_books(mongo, query='', category='', active_only=True):
         """Count total books matching criteria"""
         try:
-            filter_query = {}
-            if active_only:
-                filter_query['is_active'] = True
-            
-            if query:
-                filter_query['$or'] = [
-                    {'title': {'$regex': query, '$options': 'i'}},
-                    {'author': {'$regex': query, '$options': 'i'}},
-                    {'isbn': {'$regex': query, '$options': 'i'}}
-                ]
-            
-            if category:
-                filter_query['category'] = category
-            
-            return mongo.db.books.count_documents(filter_query)
-        except Exception as e:
-            print(f"Error counting books: {e}")
+            return cached_count(mongo.db.books, _search_filter(query, category, active_only))
+        except Exception:
+            logger.exception("Error counting books")
             return 0
     
+    @staticmethod
+    def get_inventory_stats(mongo):
+        """Count active titles and their available copies
+        
+        Available copies come from the counter document kept up to date by
+        book writes and issue/return, so no aggregation runs per call; it is
+        recomputed when missing or older than COUNTER_RECONCILE_INTERVAL.
+        """
+        try:
+            counter = read_counter(mongo, AVAILABLE_BOOKS)
+            built_at = counter.get('built_at') if counter else None
+            if built_at is None or (datetime.utcnow() - built_at).total_seconds() > Config.COUNTER_RECONCILE_INTERVAL:
+                available = Book.rebuild_available_counter(mongo, counter)
+            else:
+                available = counter['n']
+            return {
+                'total_books': cached_count(mongo.db.books, {'is_active': True}),
+                'available_books': available
+            }
+        except Exception:
+            logger.exception("Error getting inventory stats")
+            return {'total_books': 0, 'available_books': 0}
+    
+    @staticmethod
+    def rebuild_available_counter(mongo, previous=None):
+        """Recompute the available copies counter from the books themselves
+        
+        previous is the counter document being replaced (None to create a
+        missing one); see store_counter.
+        """
+        result = next(mongo.db.books.aggregate([
+            {'$match': {'is_active': True}},
+            {'$group': {'_id': None, 'n': {'$sum': '$available_quantity'}}}
+        ]), None)
+        available = result['n'] if result else 0
+        store_counter(mongo, AVAILABLE_BOOKS, available, previous)
+        return available
+    
     @staticmethod
     def update_quantity(mongo, book_id, change):
         """Update available quantity of a book"""
         try:
-            result = mongo.db.books.update_one(
-                {'_id': ObjectId(book_id)},
+            before = mongo.db.books.find_one_and_update(
+                {'_id': to_object_id(book_id)},
                 {
                     '$inc': {'available_quantity': change},
                     '$set': {'updated_at': datetime.utcnow()}
-                }
+                },
+                projection={'is_active': 1},
+                return_document=ReturnDocument.BEFORE
             )
-            return result.modified_count > 0
-        except Exception as e:
-            print(f"Error updating quantity: {e}")
+            if before is None:
+                return False
+            
+            if before.get('is_active', True):
+                adjust_counter(mongo, AVAILABLE_BOOKS, change)
+            return True
+        except Exception:
+            logger.exception("Error updating quantity")
             return False
     
     @staticmethod
     def get_categories(mongo):
-        """Get all unique categories"""
+        """Get all unique categories (cached, invalidated when books change)"""
         try:
-            categories = mongo.db.books.distinct('category', {'is_active': True})
-            return sorted(categories)
-        except Exception as e:
-            print(f"Error getting categories: {e}")
+            categories = cache.get(_CATEGORIES_CACHE_KEY)
+            if categories is None:
+                categories = sorted(mongo.db.books.distinct('category', {'is_active': True}))
+                cache.set(_CATEGORIES_CACHE_KEY, categories, timeout=Config.CATEGORIES_CACHE_TIMEOUT)
+            return categories
+        except Exception:
+            logger.exception("Error getting categories")
             return []
     
     @staticmethod
-    def get_available_books(mongo, skip=0, limit=12):
-        """Get books that are available for issuing"""
+    def cache_key(prefix, *parts):
+        """Cache key for anything rendered from book data; it changes on every book write"""
+        return _generation_cache_key(prefix, *parts)
+    
+    @staticmethod
+    def invalidate_caches():
+        """Forget cached categories and search pages after books are added, edited or removed"""
+        cache.delete(_CATEGORIES_CACHE_KEY)
+        cache.set(_SEARCH_GENERATION_KEY, time.time_ns(), timeout=0)
+    
+    @staticmethod
+    def search_available_books(mongo, prefix='', limit=20):
+        """Find issuable books whose title starts with prefix (typeahead lookups)"""
         try:
-            books = mongo.db.books.find({
-                'is_active': True,
-                'available_quantity': {'$gt': 0}
-            }).skip(skip).limit(limit).sort('title', 1)
+            query = {'is_active': True, 'available_quantity': {'$gt': 0}}
+            if prefix:
+                query['title'] = {'$regex': '^' + re.escape(prefix), '$options': 'i'}
+            
+            books = mongo.db.books.find(
+                query,
+                {'title': 1, 'author': 1, 'available_quantity': 1}
+            ).sort('title', 1).limit(limit).batch_size(limit)
             return list(books)
-        except Exception as e:
-            print(f"Error getting available books: {e}")
+        except Exception:
+            logger.exception("Error searching available books")
+            return []
+    
+    @staticmethod
+    def count_available_books(mongo):
+        """Count active books with copies available (reused for COUNT_CACHE_TTL)"""
+        try:
+            return cached_count(mongo.db.books, _AVAILABLE_FILTER)
+        except Exception:
+            logger.exception("Error counting available books")
+            return 0
+    
+    @staticmethod
+    def get_available_books(mongo, skip=0, limit=12, fields=None):
+        """Get books that are available for issuing (lazy cursor, consume once)"""
+        try:
+            books = mongo.db.books.find(_AVAILABLE_FILTER, fields or _LIST_PROJECTION).skip(skip).limit(limit).sort('title', 1).batch_size(limit)
+            return books
+        except Exception:
+            logger.exception("Error getting available books")
             return []
\ No newline at end of file
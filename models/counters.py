@@ -0,0 +1,51 @@
+"""
+Counter documents - Denormalised totals kept in step with the writes that change them
+"""
+from datetime import datetime
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Copies on the shelf across all active books
+AVAILABLE_BOOKS = 'available_books'
+
+
+def adjust_counter(mongo, name, delta):
+    """Apply a change to a counter (a missing counter is left for the next rebuild)
+    
+    Runs after the write it mirrors has succeeded, so a failure here is only
+    logged: the caller's write stands and the next reconcile corrects the total.
+    """
+    if not delta:
+        return
+    try:
+        mongo.db.counters.update_one({'_id': name}, {'$inc': {'n': delta}})
+    except Exception:
+        logger.exception("Error adjusting counter %s", name)
+
+
+def read_counter(mongo, name):
+    """Counter document ({'n', 'built_at'}), or None when it has not been built yet"""
+    return mongo.db.counters.find_one({'_id': name})
+
+
+def store_counter(mongo, name, value, previous=None):
+    """Save a freshly computed counter value
+    
+    Without previous, only creates a missing counter. With the counter
+    document the value was recomputed to replace, overwrites it only if no
+    other worker has rebuilt it since, so concurrent reconciles apply once.
+    """
+    now = datetime.utcnow()
+    if previous is None:
+        mongo.db.counters.update_one(
+            {'_id': name},
+            {'$setOnInsert': {'n': value, 'built_at': now}},
+            upsert=True
+        )
+    else:
+        mongo.db.counters.update_one(
+            {'_id': name, 'built_at': previous.get('built_at')},
+            {'$set': {'n': value, 'built_at': now}}
+        )
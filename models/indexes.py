@@ -0,0 +1,85 @@
+"""
+Index definitions - Creates the MongoDB indexes backing the model queries
+"""
+from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+USER_INDEXES = [
+    IndexModel([('email', ASCENDING)], unique=True),
+    IndexModel([('username', ASCENDING)], unique=True),
+    # User.get_all_users / User.count_users
+    IndexModel([('role', ASCENDING), ('created_at', DESCENDING)], background=True)
+]
+
+BOOK_INDEXES = [
+    IndexModel([('isbn', ASCENDING)], unique=True),
+    IndexModel([('author', ASCENDING)]),
+    # Book.get_all_books
+    IndexModel([('is_active', ASCENDING), ('created_at', DESCENDING)], background=True),
+    # Book.get_books_after keyset pagination
+    IndexModel([('is_active', ASCENDING), ('_id', DESCENDING)], background=True),
+    # Book.get_available_books
+    IndexModel([('is_active', ASCENDING), ('available_quantity', ASCENDING), ('title', ASCENDING)],
+               background=True),
+    # Book.search_books free-text queries
+    IndexModel([('title', TEXT), ('author', TEXT), ('description', TEXT)],
+               name='books_text_search', background=True),
+    # Book.search_books / Book.get_categories
+    IndexModel([('is_active', ASCENDING), ('category', ASCENDING), ('title', ASCENDING)],
+               background=True)
+]
+
+TRANSACTION_INDEXES = [
+    # Transaction.is_book_issued
+    IndexModel([('book_id', ASCENDING), ('status', ASCENDING)], background=True),
+    # Transaction.get_all_transactions keyset pagination
+    IndexModel([('issue_date', DESCENDING), ('_id', DESCENDING)], background=True),
+    # Transaction.get_all_transactions filtered by status, same keyset order
+    IndexModel([('status', ASCENDING), ('issue_date', DESCENDING), ('_id', DESCENDING)],
+               background=True),
+    # Transaction.user_has_issued
+    IndexModel([('user_id', ASCENDING), ('book_id', ASCENDING), ('status', ASCENDING)], background=True),
+    # Transaction.get_overdue_transactions
+    IndexModel([('status', ASCENDING), ('due_date', ASCENDING)], background=True),
+    # Transaction.get_user_transactions keyset pagination, with and without a status
+    IndexModel([('user_id', ASCENDING), ('status', ASCENDING), ('issue_date', DESCENDING), ('_id', DESCENDING)],
+               background=True),
+    IndexModel([('user_id', ASCENDING), ('issue_date', DESCENDING), ('_id', DESCENDING)],
+               background=True)
+]
+
+
+_COLLECTION_INDEXES = {
+    'users': USER_INDEXES,
+    'books': BOOK_INDEXES,
+    'transactions': TRANSACTION_INDEXES
+}
+
+# Collections whose indexes were confirmed by ensure_indexes in this process
+_ready_collections = set()
+
+
+def indexes_ready(collection_name):
+    """Whether a collection's indexes (and so its unique constraints) are known to exist"""
+    return collection_name in _ready_collections
+
+
+def ensure_indexes(mongo):
+    """Create all collection indexes; safe to call on every startup
+    
+    Each collection is attempted separately, so one failure does not leave
+    the others unindexed. Returns True only if every collection succeeded.
+    """
+    all_ready = True
+    for name, indexes in _COLLECTION_INDEXES.items():
+        try:
+            mongo.db[name].create_indexes(indexes)
+            _ready_collections.add(name)
+        except Exception:
+            all_ready = False
+            logger.exception("Error creating %s indexes; unique constraints on it are not enforced", name)
+    return all_ready
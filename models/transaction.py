@@ -2,8 +2,98 @@
 Transaction Model - Handles book issue and return transactions
 """
 from datetime import datetime, timedelta
-from bson.objectid import ObjectId
+from models.utils import to_object_id, cached_count
+from models.counters import AVAILABLE_BOOKS, adjust_counter
 from config import Config
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+_MS_PER_DAY = 24 * 60 * 60 * 1000
+
+# Cursor batch size for unbounded scans such as the overdue sweep
+_SWEEP_BATCH_SIZE = 500
+
+
+# Joined fields actually shown next to a transaction in the list views
+_BOOK_LOOKUP_PROJECTION = {'title': 1, 'author': 1, 'isbn': 1}
+_USER_LOOKUP_PROJECTION = {'username': 1, 'full_name': 1, 'email': 1}
+
+
+def _lookup_stages(collection, local_field, as_field, projection=None):
+    """Aggregation stages that join a single related document onto each transaction"""
+    if projection:
+        # Project inside the join so large fields never enter the pipeline
+        lookup = {
+            'from': collection,
+            'let': {'ref_id': f'${local_field}'},
+            'pipeline': [
+                {'$match': {'$expr': {'$eq': ['$_id', '$$ref_id']}}},
+                {'$project': projection}
+            ],
+            'as': as_field
+        }
+    else:
+        lookup = {
+            'from': collection,
+            'localField': local_field,
+            'foreignField': '_id',
+            'as': as_field
+        }
+    
+    return [
+        {'$lookup': lookup},
+        {'$unwind': {'path': f'${as_field}', 'preserveNullAndEmptyArrays': True}}
+    ]
+
+
+def _fine_stages():
+    """Stages adding days_overdue and current_fine, evaluated server-side against $$NOW"""
+    return [
+        {'$addFields': {
+            'days_overdue': {'$cond': [
+                {'$and': [
+                    {'$eq': ['$status', 'issued']},
+                    {'$gt': ['$$NOW', '$due_date']}
+                ]},
+                {'$floor': {'$divide': [{'$subtract': ['$$NOW', '$due_date']}, _MS_PER_DAY]}},
+                0
+            ]}
+        }},
+        {'$addFields': {
+            'current_fine': {'$multiply': ['$days_overdue', Config.FINE_PER_DAY]}
+        }}
+    ]
+
+
+def _keyset_filter(query, after_date, after_id):
+    """Restrict query to transactions after an (issue_date, _id) cursor in newest-first order"""
+    if after_date and after_id:
+        after_oid = to_object_id(after_id)
+        query['$or'] = [
+            {'issue_date': {'$lt': after_date}},
+            {'issue_date': after_date, '_id': {'$lt': after_oid}}
+        ]
+    return query
+
+
+def _release_book(mongo, book_oid):
+    """Give back a copy reserved by issue_book when the issue cannot complete"""
+    before = mongo.db.books.find_one_and_update(
+        {'_id': book_oid},
+        {
+            '$inc': {
+                'available_quantity': 1,
+                'total_issued': -1
+            },
+            '$set': {'updated_at': datetime.utcnow()}
+        },
+        projection={'is_active': 1}
+    )
+    if before and before.get('is_active', True):
+        adjust_counter(mongo, AVAILABLE_BOOKS, 1)
 
 
 class Transaction:
@@ -13,78 +103,82 @@ class Transaction:
     def issue_book(mongo, user_id, book_id, issued_by_admin_id):
         """Issue a book to a user"""
         try:
-            # Check if book is available
-            book = mongo.db.books.find_one({'_id': ObjectId(book_id)})
-            if not book or book.get('available_quantity', 0) <= 0:
-                return None
+            book_oid = to_object_id(book_id)
+            user_oid = to_object_id(user_id)
+            admin_oid = to_object_id(issued_by_admin_id)
+            now = datetime.utcnow()
             
-            # Check user's current issued books count
-            user = mongo.db.users.find_one({'_id': ObjectId(user_id)})
-            if not user:
+            # Reserve a copy only if one is available (atomic check-and-decrement);
+            # deleted books are never issued, nor counted in the available copies counter
+            book_result = mongo.db.books.update_one(
+                {'_id': book_oid, 'is_active': True, 'available_quantity': {'$gt': 0}},
+                {
+                    '$inc': {
+                        'available_quantity': -1,
+                        'total_issued': 1
+                    },
+                    '$set': {'updated_at': now}
+                }
+            )
+            if book_result.modified_count == 0:
                 return None
+            adjust_counter(mongo, AVAILABLE_BOOKS, -1)
             
-            current_issued = mongo.db.transactions.count_documents({
-                'user_id': ObjectId(user_id),
-                'status': 'issued'
-            })
-            
-            if current_issued >= Config.MAX_BOOKS_PER_USER:
+            # Claim one of the user's issue slots, enforcing the per-user limit
+            user_result = mongo.db.users.update_one(
+                {'_id': user_oid, 'books_issued': {'$lt': Config.MAX_BOOKS_PER_USER}},
+                {
+                    '$inc': {'books_issued': 1},
+                    '$set': {'updated_at': now}
+                }
+            )
+            if user_result.modified_count == 0:
+                _release_book(mongo, book_oid)
                 return None
             
             # Create transaction
-            issue_date = datetime.utcnow()
+            issue_date = now
             due_date = issue_date + timedelta(days=Config.DEFAULT_ISSUE_DAYS)
             
             transaction_data = {
-                'user_id': ObjectId(user_id),
-                'book_id': ObjectId(book_id),
-                'issued_by': ObjectId(issued_by_admin_id),
+                'user_id': user_oid,
+                'book_id': book_oid,
+                'issued_by': admin_oid,
                 'issue_date': issue_date,
                 'due_date': due_date,
                 'return_date': None,
                 'status': 'issued',
                 'fine': 0.0,
                 'fine_paid': False,
-                'created_at': datetime.utcnow(),
-                'updated_at': datetime.utcnow()
+                'created_at': now,
+                'updated_at': now
             }
             
-            result = mongo.db.transactions.insert_one(transaction_data)
-            
-            if result.inserted_id:
-                # Update book available quantity
-                mongo.db.books.update_one(
-                    {'_id': ObjectId(book_id)},
-                    {
-                        '$inc': {
-                            'available_quantity': -1,
-                            'total_issued': 1
-                        },
-                        '$set': {'updated_at': datetime.utcnow()}
-                    }
-                )
-                
-                # Update user's books issued count
+            try:
+                result = mongo.db.transactions.insert_one(transaction_data)
+            except Exception:
+                # Undo both reservations so the counters stay consistent
+                _release_book(mongo, book_oid)
                 mongo.db.users.update_one(
-                    {'_id': ObjectId(user_id)},
+                    {'_id': user_oid},
                     {
-                        '$inc': {'books_issued': 1},
-                        '$set': {'updated_at': datetime.utcnow()}
+                        '$inc': {'books_issued': -1},
+                        '$set': {'updated_at': now}
                     }
                 )
-                
-                return result.inserted_id
+                raise
             
-            return None
-        except Exception as e:
-            print(f"Error issuing book: {e}")
+            return result.inserted_id
+        except Exception:
+            logger.exception("Error issuing book")
             return None
     
     @staticmethod
     def return_book(mongo, transaction_id, returned_to_admin_id):
         """Return a book and calculate fine if overdue"""
         try:
-            transaction = mongo.db.transactions.find_one({'_id': ObjectId(transaction_id)})
+            transaction_oid = to_object_id(transaction_id)
+            transaction = mongo.db.transactions.find_one({'_id': transaction_oid})
             if not transaction or transaction.get('status') != 'issued':
                 return None
             
@@ -93,33 +187,38 @@ class Transaction:
             
             # Calculate fine if overdue
             fine = 0.0
+            days_overdue = 0
             if return_date > due_date:
                 days_overdue = (return_date - due_date).days
                 fine = days_overdue * Config.FINE_PER_DAY
             
             # Update transaction
             result = mongo.db.transactions.update_one(
-                {'_id': ObjectId(transaction_id)},
+                {'_id': transaction_oid},
                 {
                     '$set': {
                         'return_date': return_date,
                         'status': 'returned',
                         'fine': fine,
-                        'returned_to': ObjectId(returned_to_admin_id),
-                        'updated_at': datetime.utcnow()
+                        'returned_to': to_object_id(returned_to_admin_id),
+                        'updated_at': return_date
                     }
                 }
             )
             
             if result.modified_count > 0:
-                # Update book available quantity
-                mongo.db.books.update_one(
+                # Update book available quantity; copies of a deleted book are
+                # not part of the available copies counter
+                book = mongo.db.books.find_one_and_update(
                     {'_id': transaction['book_id']},
                     {
                         '$inc': {'available_quantity': 1},
-                        '$set': {'updated_at': datetime.utcnow()}
-                    }
+                        '$set': {'updated_at': return_date}
+                    },
+                    projection={'is_active': 1}
                 )
+                if book and book.get('is_active', True):
+                    adjust_counter(mongo, AVAILABLE_BOOKS, 1)
                 
                 # Update user's books issued count and total fines
                 mongo.db.users.update_one(
@@ -129,90 +228,122 @@ class Transaction:
                             'books_issued': -1,
                             'total_fines': fine
                         },
-                        '$set': {'updated_at': datetime.utcnow()}
+                        '$set': {'updated_at': return_date}
                     }
                 )
                 
                 return {
                     'status': 'success',
                     'fine': fine,
-                    'days_overdue': (return_date - due_date).days if return_date > due_date else 0
+                    'days_overdue': days_overdue
                 }
             
             return None
-        except Exception as e:
-            print(f"Error returning book: {e}")
+        except Exception:
+            logger.exception("Error returning book")
             return None
     
     @staticmethod
     def get_by_id(mongo, transaction_id):
         """Get transaction by ID with book and user details"""
         try:
-            transaction = mongo.db.transactions.find_one({'_id': ObjectId(transaction_id)})
-            if transaction:
-                # Populate book and user details
-                transaction['book'] = mongo.db.books.find_one({'_id': transaction['book_id']})
-                transaction['user'] = mongo.db.users.find_one({'_id': transaction['user_id']})
-            return transaction
-        except Exception as e:
-            print(f"Error getting transaction: {e}")
+            pipeline = [
+                {'$match': {'_id': to_object_id(transaction_id)}},
+                {'$limit': 1},
+                # Populate book and user details (never the user's password hash)
+                *_lookup_stages('books', 'book_id', 'book', _BOOK_LOOKUP_PROJECTION),
+                *_lookup_stages('users', 'user_id', 'user', _USER_LOOKUP_PROJECTION)
+            ]
+            
+            return next(mongo.db.transactions.aggregate(pipeline), None)
+        except Exception:
+            logger.exception("Error getting transaction")
             return None
     
     @staticmethod
-    def get_user_transactions(mongo, user_id, status=None, skip=0, limit=20):
-        """Get all transactions for a specific user"""
+    def get_user_transactions(mongo, user_id, status=None, limit=20, after_date=None, after_id=None):
+        """Get transactions for a specific user, newest first
+        
+        Pages with the same issue_date/_id keyset as get_all_transactions.
+        """
         try:
-            query = {'user_id': ObjectId(user_id)}
+            query = {'user_id': to_object_id(user_id)}
             if status:
                 query['status'] = status
+            _keyset_filter(query, after_date, after_id)
             
-            transactions = mongo.db.transactions.find(query).skip(skip).limit(limit).sort('issue_date', -1)
-            result = []
-            
-            for trans in transactions:
-                trans['book'] = mongo.db.books.find_one({'_id': trans['book_id']})
-                
-                # Calculate current fine for issued books
-                if trans['status'] == 'issued' and datetime.utcnow() > trans['due_date']:
-                    days_overdue = (datetime.utcnow() - trans['due_date']).days
-                    trans['current_fine'] = days_overdue * Config.FINE_PER_DAY
-                else:
-                    trans['current_fine'] = 0.0
-                
-                result.append(trans)
+            pipeline = [
+                {'$match': query},
+                {'$sort': {'issue_date': -1, '_id': -1}},
+                {'$limit': limit},
+                *_lookup_stages('books', 'book_id', 'book', _BOOK_LOOKUP_PROJECTION),
+                *_fine_stages()
+            ]
             
-            return result
-        except Exception as e:
-            print(f"Error getting user transactions: {e}")
+            return list(mongo.db.transactions.aggregate(pipeline, batchSize=limit))
+        except Exception:
+            logger.exception("Error getting user transactions")
             return []
     
     @staticmethod
-    def get_all_transactions(mongo, status=None, skip=0, limit=20):
-        """Get all transactions with optional status filter"""
+    def get_issued_with_fines(mongo, user_id, limit=20, after_date=None, after_id=None):
+        """Get a page of a user's issued books plus the fine pending across all of them
+        
+        Returns (transactions, total_fines); the total covers every issued book,
+        not just the page, and both come from one $facet aggregation.
+        """
+        try:
+            pipeline = [
+                {'$match': {'user_id': to_object_id(user_id), 'status': 'issued'}},
+                {'$facet': {
+                    'page': [
+                        {'$match': _keyset_filter({}, after_date, after_id)},
+                        {'$sort': {'issue_date': -1, '_id': -1}},
+                        {'$limit': limit},
+                        *_lookup_stages('books', 'book_id', 'book', _BOOK_LOOKUP_PROJECTION),
+                        *_fine_stages()
+                    ],
+                    'totals': [
+                        *_fine_stages(),
+                        {'$group': {'_id': None, 'total_fines': {'$sum': '$current_fine'}}}
+                    ]
+                }}
+            ]
+            
+            result = next(mongo.db.transactions.aggregate(pipeline), None)
+            if not result:
+                return [], 0
+            total_fines = result['totals'][0]['total_fines'] if result['totals'] else 0
+            return result['page'], total_fines
+        except Exception:
+            logger.exception("Error getting issued books")
+            return [], 0
+    
+    @staticmethod
+    def get_all_transactions(mongo, status=None, limit=20, after_date=None, after_id=None):
+        """Get all transactions with optional status filter, newest first
+        
+        Pages with a keyset: pass the issue_date and _id of the last transaction
+        of the previous page as after_date/after_id to get the next page.
+        """
         try:
             query = {}
             if status:
                 query['status'] = status
+            _keyset_filter(query, after_date, after_id)
             
-            transactions = mongo.db.transactions.find(query).skip(skip).limit(limit).sort('issue_date', -1)
-            result = []
-            
-            for trans in transactions:
-                trans['book'] = mongo.db.books.find_one({'_id': trans['book_id']})
-                trans['user'] = mongo.db.users.find_one({'_id': trans['user_id']})
-                
-                # Calculate current fine for issued books
-                if trans['status'] == 'issued' and datetime.utcnow() > trans['due_date']:
-                    days_overdue = (datetime.utcnow() - trans['due_date']).days
-                    trans['current_fine'] = days_overdue * Config.FINE_PER_DAY
-                else:
-                    trans['current_fine'] = 0.0
-                
-                result.append(trans)
+            pipeline = [
+                {'$match': query},
+                {'$sort': {'issue_date': -1, '_id': -1}},
+                {'$limit': limit},
+                *_lookup_stages('books', 'book_id', 'book', _BOOK_LOOKUP_PROJECTION),
+                *_lookup_stages('users', 'user_id', 'user', _USER_LOOKUP_PROJECTION),
+                *_fine_stages()
+            ]
             
-            return result
-        except Exception as e:
-            print(f"Error getting transactions: {e}")
+            return list(mongo.db.transactions.aggregate(pipeline, batchSize=limit))
+        except Exception:
+            logger.exception("Error getting transactions")
             return []
     
     @staticmethod
@@ -221,36 +352,99 @@ class Transaction:
         try:
             query = {}
             if user_id:
-                query['user_id'] = ObjectId(user_id)
+                query['user_id'] = to_object_id(user_id)
             if status:
                 query['status'] = status
             
-            return mongo.db.transactions.count_documents(query)
-        except Exception as e:
-            print(f"Error counting transactions: {e}")
+            return cached_count(mongo.db.transactions, query)
+        except Exception:
+            logger.exception("Error counting transactions")
             return 0
     
     @staticmethod
-    def get_overdue_transactions(mongo):
-        """Get all overdue transactions"""
+    def is_book_issued(mongo, book_id):
+        """Check whether any copy of a book is currently issued"""
+        try:
+            return mongo.db.transactions.count_documents(
+                {'book_id': to_object_id(book_id), 'status': 'issued'},
+                limit=1
+            ) > 0
+        except Exception:
+            logger.exception("Error checking issued book")
+            return False
+    
+    @staticmethod
+    def user_has_issued(mongo, user_id, book_id):
+        """Check whether a user currently holds a copy of a book"""
         try:
-            transactions = mongo.db.transactions.find({
+            return mongo.db.transactions.count_documents(
+                {'user_id': to_object_id(user_id), 'book_id': to_object_id(book_id), 'status': 'issued'},
+                limit=1
+            ) > 0
+        except Exception:
+            logger.exception("Error checking user's issued books")
+            return False
+    
+    @staticmethod
+    def get_overdue_transactions(mongo, skip=0, limit=None):
+        """Get overdue transactions, oldest due date first (all of them unless limit is given)"""
+        try:
+            pipeline = [
+                {'$match': {
+                    'status': 'issued',
+                    'due_date': {'$lt': datetime.utcnow()}
+                }},
+                {'$sort': {'due_date': 1}}
+            ]
+            # Page before the joins so only the requested rows are looked up
+            if skip:
+                pipeline.append({'$skip': skip})
+            if limit:
+                pipeline.append({'$limit': limit})
+            pipeline += [
+                *_lookup_stages('books', 'book_id', 'book', _BOOK_LOOKUP_PROJECTION),
+                *_lookup_stages('users', 'user_id', 'user', _USER_LOOKUP_PROJECTION),
+                *_fine_stages()
+            ]
+            
+            return list(mongo.db.transactions.aggregate(pipeline, batchSize=min(limit or _SWEEP_BATCH_SIZE, _SWEEP_BATCH_SIZE)))
+        except Exception:
+            logger.exception("Error getting overdue transactions")
+            return []
+    
+    @staticmethod
+    def count_overdue(mongo):
+        """Count overdue transactions (served by the status/due_date index)"""
+        try:
+            return mongo.db.transactions.count_documents({
                 'status': 'issued',
                 'due_date': {'$lt': datetime.utcnow()}
-            }).sort('due_date', 1)
-            
-            result = []
-            for trans in transactions:
-                trans['book'] = mongo.db.books.find_one({'_id': trans['book_id']})
-                trans['user'] = mongo.db.users.find_one({'_id': trans['user_id']})
-                
-                days_overdue = (datetime.utcnow() - trans['due_date']).days
-                trans['current_fine'] = days_overdue * Config.FINE_PER_DAY
-                trans['days_overdue'] = days_overdue
-                
-                result.append(trans)
+            })
+        except Exception:
+            logger.exception("Error counting overdue transactions")
+            return 0
+    
+    @staticmethod
+    def overdue_stats(mongo):
+        """Count overdue transactions and total their pending fines server-side"""
+        try:
+            pipeline = [
+                {'$match': {
+                    'status': 'issued',
+                    'due_date': {'$lt': datetime.utcnow()}
+                }},
+                *_fine_stages(),
+                {'$group': {
+                    '_id': None,
+                    'count': {'$sum': 1},
+                    'total_fines': {'$sum': '$current_fine'}
+                }}
+            ]
             
-            return result
-        except Exception as e:
-            print(f"Error getting overdue transactions: {e}")
-            return []
\ No newline at end of file
+            result = next(mongo.db.transactions.aggregate(pipeline), None)
+            if result is None:
+                return {'count': 0, 'total_fines': 0}
+            return {'count': result['count'], 'total_fines': result['total_fines']}
+        except Exception:
+            logger.exception("Error computing overdue statistics")
+            return {'count': 0, 'total_fines': 0}
@@ -1,138 +1,286 @@
 """
 User Model - Handles user data structure and operations
 """
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import datetime
-from bson.objectid import ObjectId
+from models.utils import to_object_id, cached_count
+from models.indexes import indexes_ready
+from config import Config
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from pymongo.write_concern import WriteConcern
+from bson.errors import InvalidId
+import bcrypt
+import hashlib
+import re
+import threading
+import time
+
+
+# Lightweight read-only row for user pickers (id is the stringified ObjectId)
+UserRow = namedtuple('UserRow', 'id username full_name')
+
+# Default projection for reads: the password hash only leaves the database
+# when a caller explicitly asks for it
+_PUBLIC_PROJECTION = {'password': 0}
+
+
+# Profile writes only need primary acknowledgement; issue/return keep the
+# client's journaled default in the transaction model
+_PROFILE_WRITE_CONCERN = WriteConcern(w=1, j=False)
+
+
+def _users_for_writes(mongo):
+    """Users collection handle using the relaxed profile write concern"""
+    return mongo.db.users.with_options(write_concern=_PROFILE_WRITE_CONCERN)
+
+
+# bcrypt only looks at the first 72 bytes of a password
+MAX_PASSWORD_BYTES = 72
+
+
+def password_too_long(password):
+    """Whether a new password exceeds what the configured hash can verify in full
+    
+    Only bcrypt has a length limit; werkzeug methods accept any length.
+    """
+    if Config.PASSWORD_HASH_METHOD != 'bcrypt':
+        return False
+    return len(password.encode('utf-8')) > MAX_PASSWORD_BYTES
+
+
+def _hash_password(password):
+    """Hash a password with the configured method (bcrypt at the configured work factor by default)"""
+    if Config.PASSWORD_HASH_METHOD != 'bcrypt':
+        return generate_password_hash(password, method=Config.PASSWORD_HASH_METHOD)
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(Config.BCRYPT_COST)).decode('utf-8')
+
+
+def _check_password(password_hash, password):
+    """Verify a password against a bcrypt hash or a werkzeug hash"""
+    if password_hash.startswith('$2'):
+        encoded = password.encode('utf-8')
+        # A bcrypt hash can never match more than 72 bytes; still spend the hashing
+        # time on the truncated password so the answer takes as long as any other
+        matched = bcrypt.checkpw(encoded[:MAX_PASSWORD_BYTES], password_hash.encode('utf-8'))
+        return matched and len(encoded) <= MAX_PASSWORD_BYTES
+    # Accounts created before the switch to bcrypt, or with a non-bcrypt PASSWORD_HASH_METHOD
+    return check_password_hash(password_hash, password)
+
+
+@lru_cache(maxsize=1)
+def _dummy_hash():
+    """Hash verified when a login names no user, so misses cost as much as hits"""
+    return _hash_password('dummy-password')
+
+
+# Recent successful password verifications, so repeated logins skip the KDF.
+# Failures are never cached: a repeated wrong guess must cost as much as a
+# guess against an unknown user, or the timing would reveal which accounts exist
+_VERIFY_CACHE_SIZE = 1024
+_VERIFY_CACHE_TTL = 60  # seconds
+_verify_cache = OrderedDict()
+_verify_cache_lock = threading.Lock()
+
+
+def _verify_password_cached(user, password):
+    """Check a user's password, reusing a recent success for the same hash and password"""
+    # Keyed on the stored hash too, so a password change never hits a stale entry
+    digest = hashlib.sha256(f"{user['password']}:{password}".encode('utf-8')).digest()
+    key = (str(user['_id']), digest)
+    now = time.monotonic()
+    
+    with _verify_cache_lock:
+        entry = _verify_cache.get(key)
+        if entry is not None and now - entry < _VERIFY_CACHE_TTL:
+            _verify_cache.move_to_end(key)
+            return True
+    
+    if not _check_password(user['password'], password):
+        return False
+    
+    with _verify_cache_lock:
+        _verify_cache[key] = now
+        _verify_cache.move_to_end(key)
+        while len(_verify_cache) > _VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+    
+    return True
+
+
+def _invalidate_verify_cache(user_id):
+    """Drop cached verification results for a user"""
+    user_id = str(user_id)
+    with _verify_cache_lock:
+        for key in [key for key in _verify_cache if key[0] == user_id]:
+            del _verify_cache[key]
 
 
 class User:
-    """User model for managing user data"""
+    """User model for managing user data
+
+    Database errors propagate to the caller (the app renders them as a 500);
+    only malformed ids, which come straight from request input, are handled here.
+    """
     
     @staticmethod
     def create_user(mongo, username, email, password, full_name, role='user', phone='', address=''):
         """Create a new user in the database"""
+        now = datetime.utcnow()
+        user_data = {
+            'username': username,
+            'email': email,
+            'password': _hash_password(password),
+            'full_name': full_name,
+            'role': role,
+            'phone': phone,
+            'address': address,
+            'created_at': now,
+            'updated_at': now,
+            'is_active': True,
+            'books_issued': 0,
+            'total_fines': 0.0
+        }
+        
+        # Without confirmed unique indexes (failed build, database down at boot)
+        # fall back to checking first, so duplicates are still refused
+        if not indexes_ready('users') and mongo.db.users.find_one(
+                {'$or': [{'email': email}, {'username': username}]}, {'_id': 1}):
+            return None
+        
+        # The unique username/email indexes reject existing users atomically
         try:
-            # Check if user already exists
-            if mongo.db.users.find_one({'$or': [{'email': email}, {'username': username}]}):
-                return None
-            
-            user_data = {
-                'username': username,
-                'email': email,
-                'password': generate_password_hash(password),
-                'full_name': full_name,
-                'role': role,
-                'phone': phone,
-                'address': address,
-                'created_at': datetime.utcnow(),
-                'updated_at': datetime.utcnow(),
-                'is_active': True,
-                'books_issued': 0,
-                'total_fines': 0.0
-            }
-            
-            result = mongo.db.users.insert_one(user_data)
-            return result.inserted_id
-        except Exception as e:
-            print(f"Error creating user: {e}")
+            result = _users_for_writes(mongo).insert_one(user_data)
+        except DuplicateKeyError:
             return None
+        return result.inserted_id
     
     @staticmethod
     def authenticate(mongo, username_or_email, password):
         """Authenticate user with username/email and password"""
-        try:
-            user = mongo.db.users.find_one({
-                '$or': [
-                    {'username': username_or_email},
-                    {'email': username_or_email}
-                ]
-            })
-            
-            if user and check_password_hash(user['password'], password):
-                if user.get('is_active', True):
-                    return user
+        # Nothing that could ever verify is worth a lookup or a hash
+        if not password:
             return None
-        except Exception as e:
-            print(f"Error authenticating user: {e}")
+        
+        user = mongo.db.users.find_one({
+            '$or': [
+                {'username': username_or_email},
+                {'email': username_or_email}
+            ]
+        })
+        
+        if user is None:
+            # Spend the same hashing time as a wrong password to avoid leaking which accounts exist
+            _check_password(_dummy_hash(), password)
             return None
+        
+        if _verify_password_cached(user, password):
+            if user.get('is_active', True):
+                return user
+        return None
     
     @staticmethod
-    def get_by_id(mongo, user_id):
-        """Get user by ID"""
+    def verify_password(user, password):
+        """Check a password against an already loaded user document"""
+        return _verify_password_cached(user, password)
+    
+    @staticmethod
+    def get_by_id(mongo, user_id, fields=None):
+        """Get user by ID, optionally limited to the given projection"""
         try:
-            return mongo.db.users.find_one({'_id': ObjectId(user_id)})
-        except Exception as e:
-            print(f"Error getting user: {e}")
+            user_oid = to_object_id(user_id)
+        except (InvalidId, TypeError):
             return None
+        return mongo.db.users.find_one({'_id': user_oid}, fields or _PUBLIC_PROJECTION)
     
     @staticmethod
     def update_user(mongo, user_id, update_data):
         """Update user information"""
         try:
-            update_data['updated_at'] = datetime.utcnow()
-            result = mongo.db.users.update_one(
-                {'_id': ObjectId(user_id)},
-                {'$set': update_data}
-            )
-            return result.modified_count > 0
-        except Exception as e:
-            print(f"Error updating user: {e}")
+            user_oid = to_object_id(user_id)
+        except (InvalidId, TypeError):
             return False
+        
+        update_data['updated_at'] = datetime.utcnow()
+        result = _users_for_writes(mongo).update_one(
+            {'_id': user_oid},
+            {'$set': update_data}
+        )
+        return result.modified_count > 0
     
     @staticmethod
     def change_password(mongo, user_id, new_password):
         """Change user password"""
         try:
-            hashed_password = generate_password_hash(new_password)
-            result = mongo.db.users.update_one(
-                {'_id': ObjectId(user_id)},
-                {'$set': {'password': hashed_password, 'updated_at': datetime.utcnow()}}
-            )
-            return result.modified_count > 0
-        except Exception as e:
-            print(f"Error changing password: {e}")
+            user_oid = to_object_id(user_id)
+        except (InvalidId, TypeError):
             return False
+        
+        hashed_password = _hash_password(new_password)
+        _invalidate_verify_cache(user_oid)
+        result = _users_for_writes(mongo).update_one(
+            {'_id': user_oid},
+            {'$set': {'password': hashed_password, 'updated_at': datetime.utcnow()}}
+        )
+        return result.modified_count > 0
     
     @staticmethod
-    def get_all_users(mongo, role=None, skip=0, limit=20):
-        """Get all users with optional role filter"""
-        try:
-            query = {}
-            if role:
-                query['role'] = role
-            
-            users = mongo.db.users.find(query).skip(skip).limit(limit).sort('created_at', -1)
-            return list(users)
-        except Exception as e:
-            print(f"Error getting users: {e}")
-            return []
+    def get_all_users(mongo, role=None, skip=0, limit=20, fields=None, as_cursor=False):
+        """Get all users with optional role filter
+
+        With as_cursor=True the open cursor is returned so templates can
+        iterate it batch by batch instead of receiving a materialised list.
+        """
+        query = {}
+        if role:
+            query['role'] = role
+        
+        users = mongo.db.users.find(query, fields or _PUBLIC_PROJECTION).skip(skip).limit(limit).sort('created_at', -1).batch_size(min(limit, 100))
+        return users if as_cursor else list(users)
+    
+    @staticmethod
+    def search_users(mongo, prefix='', role='user', limit=20):
+        """Find users whose username starts with prefix (typeahead lookups), as UserRow tuples"""
+        query = {}
+        if role:
+            query['role'] = role
+        if prefix:
+            query['username'] = {'$regex': '^' + re.escape(prefix), '$options': 'i'}
+        
+        users = mongo.db.users.find(
+            query,
+            {'username': 1, 'full_name': 1}
+        ).sort('username', 1).limit(limit).batch_size(limit)
+        return [UserRow(str(user['_id']), user['username'], user['full_name']) for user in users]
     
     @staticmethod
     def count_users(mongo, role=None):
         """Count total users"""
-        try:
-            query = {}
-            if role:
-                query['role'] = role
-            return mongo.db.users.count_documents(query)
-        except Exception as e:
-            print(f"Error counting users: {e}")
-            return 0
+        query = {}
+        if role:
+            query['role'] = role
+        return cached_count(mongo.db.users, query)
     
     @staticmethod
     def toggle_active_status(mongo, user_id):
         """Toggle user active status"""
         try:
-            user = mongo.db.users.find_one({'_id': ObjectId(user_id)})
-            if user:
-                new_status = not user.get('is_active', True)
-                result = mongo.db.users.update_one(
-                    {'_id': ObjectId(user_id)},
-                    {'$set': {'is_active': new_status, 'updated_at': datetime.utcnow()}}
-                )
-                return result.modified_count > 0
+            user_oid = to_object_id(user_id)
+        except (InvalidId, TypeError):
             return False
-        except Exception as e:
-            print(f"Error toggling user status: {e}")
-            return False
\ No newline at end of file
+        
+        _invalidate_verify_cache(user_oid)
+        # Flip the flag server-side so concurrent toggles can't both read the same value
+        # (a missing is_active counts as active)
+        user = mongo.db.users.find_one_and_update(
+            {'_id': user_oid},
+            [{'$set': {
+                'is_active': {'$not': [{'$ifNull': ['$is_active', True]}]},
+                'updated_at': '$$NOW'
+            }}],
+            projection={'is_active': 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return user is not None
@@ -0,0 +1,76 @@
+"""
+Model helpers shared across collections
+"""
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
+from bson.objectid import ObjectId
+from collections import OrderedDict
+from pymongo.errors import ExecutionTimeout
+from config import Config
+import threading
+import time
+
+
+def to_object_id(value):
+    """Return value as an ObjectId, parsing it only when it is not one already"""
+    return value if isinstance(value, ObjectId) else ObjectId(value)
+
+
+
+class ObjectIdToStr(TypeDecoder):
+    """Decode ObjectIds straight to their hex string while the BSON is parsed"""
+    bson_type = ObjectId
+    
+    def transform_bson(self, value):
+        return str(value)
+
+
+# Codec options for read handles whose documents go straight into JSON responses
+JSON_CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry([ObjectIdToStr()]))
+
+
+def codec_tag(mongo):
+    """Short name for how a handle decodes documents, for keys of cached query results"""
+    return 'json' if mongo.db.codec_options == JSON_CODEC_OPTIONS else 'bson'
+
+
+# Recently computed count_documents results, keyed by collection and filter
+_COUNT_CACHE_SIZE = 64
+_count_cache = OrderedDict()
+_count_cache_lock = threading.Lock()
+
+
+def cached_count(collection, query):
+    """Count documents matching query, reusing a result younger than COUNT_CACHE_TTL
+    
+    A count that runs past COUNT_MAX_TIME_MS falls back to counting at most
+    COUNT_FALLBACK_LIMIT matches rather than holding the request. The result
+    never reaches beyond the filter; if even the capped count times out, the
+    timeout propagates and nothing is cached.
+    """
+    if not query:
+        # Unfiltered totals come straight from collection metadata
+        return collection.estimated_document_count()
+    
+    key = (collection.full_name, repr(query))
+    now = time.monotonic()
+    
+    with _count_cache_lock:
+        entry = _count_cache.get(key)
+        if entry and now - entry[1] < Config.COUNT_CACHE_TTL:
+            _count_cache.move_to_end(key)
+            return entry[0]
+    
+    try:
+        count = collection.count_documents(query, maxTimeMS=Config.COUNT_MAX_TIME_MS)
+    except ExecutionTimeout:
+        # Too slow to count exactly; a capped count still only covers matching documents
+        count = collection.count_documents(query, limit=Config.COUNT_FALLBACK_LIMIT,
+                                           maxTimeMS=Config.COUNT_MAX_TIME_MS)
+    
+    with _count_cache_lock:
+        _count_cache[key] = (count, now)
+        _count_cache.move_to_end(key)
+        while len(_count_cache) > _COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    
+    return count
@@ -1,9 +1,19 @@
 """
 Routes package initialization
 """
-from .auth import auth_bp
-from .admin import admin_bp
-from .user import user_bp
-from .books import books_bp
 
-__all__ = ['auth_bp', 'admin_bp', 'user_bp', 'books_bp']
\ No newline at end of file
+
+def register_blueprints(app):
+    """Import and register every blueprint (importing the package alone loads no routes)"""
+    from .auth import auth_bp
+    from .admin import admin_bp
+    from .user import user_bp
+    from .books import books_bp
+    
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    app.register_blueprint(user_bp, url_prefix='/user')
+    app.register_blueprint(books_bp, url_prefix='/books')
+
+
+__all__ = ['register_blueprints']
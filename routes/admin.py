@@ -1,16 +1,20 @@
 """
 Admin Routes - Admin dashboard and management functions
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, session, jsonify
 from routes.auth import admin_required
+from routes.pagination import transaction_cursor, next_transaction_cursor
 from models.user import User
 from models.book import Book
 from models.transaction import Transaction
 from bson.objectid import ObjectId
-from datetime import datetime
+from extensions import query_executor
 
 admin_bp = Blueprint('admin', __name__)
 
+# Options returned per lookup by the issue book typeahead
+TYPEAHEAD_LIMIT = 20
+
 
 @admin_bp.route('/dashboard')
 @admin_required
@@ -18,35 +22,33 @@ def dashboard():
     """Admin dashboard with statistics"""
     mongo = current_app.mongo
     
+    # Issue the independent queries concurrently instead of one after another
+    inventory_future = query_executor.submit(Book.get_inventory_stats, mongo)
+    users_future = query_executor.submit(User.count_users, mongo, role='user')
+    issued_future = query_executor.submit(Transaction.count_transactions, mongo, status='issued')
+    recent_future = query_executor.submit(Transaction.get_all_transactions, mongo, limit=10)
+    overdue_future = query_executor.submit(Transaction.overdue_stats, mongo)
+    
     # Get statistics
-    total_books = Book.count_books(mongo, active_only=True)
-    total_users = User.count_users(mongo, role='user')
-    issued_books = Transaction.count_transactions(mongo, status='issued')
-    available_books = mongo.db.books.aggregate([
-        {'$match': {'is_active': True}},
-        {'$group': {'_id': None, 'total': {'$sum': '$available_quantity'}}}
-    ])
-    available_books = list(available_books)
-    available_count = available_books[0]['total'] if available_books else 0
+    inventory = inventory_future.result()
+    total_users = users_future.result()
+    issued_books = issued_future.result()
     
     # Get recent transactions
-    recent_transactions = Transaction.get_all_transactions(mongo, limit=10)
-    
-    # Get overdue books
-    overdue_transactions = Transaction.get_overdue_transactions(mongo)
+    recent_transactions = recent_future.result()
     
-    # Calculate total fines
-    total_fines = sum(trans.get('current_fine', 0) for trans in overdue_transactions)
+    # Overdue count and pending fines, summed by the database
+    overdue = overdue_future.result()
     
     return render_template(
         'admin/dashboard.html',
-        total_books=total_books,
+        total_books=inventory['total_books'],
         total_users=total_users,
         issued_books=issued_books,
-        available_books=available_count,
+        available_books=inventory['available_books'],
         recent_transactions=recent_transactions,
-        overdue_count=len(overdue_transactions),
-        total_fines=total_fines
+        overdue_count=overdue['count'],
+        total_fines=overdue['total_fines']
     )
 
 
@@ -63,8 +65,9 @@ def books():
     skip = (page - 1) * per_page
     
     if search_query or category:
-        books_list = Book.search_books(mongo, search_query, category, skip, per_page)
-        total_books = Book.count_books(mongo, search_query, category, active_only=False)
+        # Admins manage stock, so read it live rather than from the search cache
+        books_list, total_books = Book.search_books_paged(mongo, search_query, category, skip, per_page,
+                                                          cached=False)
     else:
         books_list = Book.get_all_books(mongo, skip, per_page, active_only=False)
         total_books = Book.count_books(mongo, active_only=False)
@@ -148,7 +151,8 @@ def add_book():
 @admin_required
 def edit_book(book_id):
     """Edit book details"""
-    book = Book.get_by_id(current_app.mongo, book_id)
+    mongo = current_app.mongo
+    book = Book.get_by_id(mongo, book_id)
     if not book:
         flash('Book not found', 'danger')
         return redirect(url_for('admin.books'))
@@ -187,7 +191,7 @@ def edit_book(book_id):
             update_data['quantity'] = new_quantity
             update_data['available_quantity'] = book['available_quantity'] + quantity_diff
         
-        if Book.update_book(current_app.mongo, book_id, update_data):
+        if Book.update_book(mongo, book_id, update_data):
             flash(f'Book "{title}" updated successfully', 'success')
             return redirect(url_for('admin.books'))
         else:
@@ -200,21 +204,18 @@ def edit_book(book_id):
 @admin_required
 def delete_book(book_id):
     """Delete (soft delete) book"""
-    book = Book.get_by_id(current_app.mongo, book_id)
+    mongo = current_app.mongo
+    book = Book.get_by_id(mongo, book_id, fields={'title': 1})
     if not book:
         flash('Book not found', 'danger')
         return redirect(url_for('admin.books'))
     
     # Check if book is currently issued
-    issued_count = Transaction.count_transactions(current_app.mongo, status='issued')
-    issued_books = Transaction.get_all_transactions(current_app.mongo, status='issued')
-    
-    for trans in issued_books:
-        if str(trans['book_id']) == book_id:
-            flash('Cannot delete book that is currently issued', 'danger')
-            return redirect(url_for('admin.books'))
+    if Transaction.is_book_issued(mongo, book_id):
+        flash('Cannot delete book that is currently issued', 'danger')
+        return redirect(url_for('admin.books'))
     
-    if Book.delete_book(current_app.mongo, book_id):
+    if Book.delete_book(mongo, book_id):
         flash(f'Book "{book["title"]}" deleted successfully', 'success')
     else:
         flash('Error deleting book', 'danger')
@@ -231,7 +232,7 @@ def users():
     per_page = 20
     
     skip = (page - 1) * per_page
-    users_list = User.get_all_users(mongo, role='user', skip=skip, limit=per_page)
+    users_list = User.get_all_users(mongo, role='user', skip=skip, limit=per_page, as_cursor=True)
     total_users = User.count_users(mongo, role='user')
     total_pages = (total_users + per_page - 1) // per_page
     
@@ -284,33 +285,76 @@ def issue_book():
         else:
             flash('Error issuing book. Check if book is available or user has reached maximum limit', 'danger')
     
-    # Get available books and active users for the form
-    available_books = Book.get_available_books(mongo, limit=1000)
-    active_users = User.get_all_users(mongo, role='user', limit=1000)
+    # Prefill the form with a first page of users and books; the rest is
+    # fetched on demand through the search endpoints below
+    books_future = query_executor.submit(Book.search_available_books, mongo, limit=TYPEAHEAD_LIMIT)
+    users_future = query_executor.submit(User.search_users, mongo, limit=TYPEAHEAD_LIMIT)
     
     return render_template(
         'admin/issue_book.html',
-        books=available_books,
-        users=active_users
+        books=books_future.result(),
+        users=users_future.result()
     )
 
 
+@admin_bp.route('/search-users')
+@admin_required
+def search_users():
+    """Username typeahead for the issue book form"""
+    query = request.args.get('q', '').strip()
+    users_list = User.search_users(current_app.mongo, query, limit=TYPEAHEAD_LIMIT)
+    
+    return jsonify({
+        'status': 'success',
+        'data': {
+            'users': [
+                {'_id': user.id, 'username': user.username, 'full_name': user.full_name}
+                for user in users_list
+            ]
+        }
+    }), 200
+
+
+@admin_bp.route('/search-books')
+@admin_required
+def search_books():
+    """Title typeahead over issuable books for the issue book form"""
+    query = request.args.get('q', '').strip()
+    books_list = Book.search_available_books(current_app.mongo, query, limit=TYPEAHEAD_LIMIT)
+    
+    return jsonify({
+        'status': 'success',
+        'data': {
+            'books': [
+                {
+                    '_id': str(book['_id']),
+                    'title': book['title'],
+                    'author': book['author'],
+                    'available_quantity': book['available_quantity']
+                }
+                for book in books_list
+            ]
+        }
+    }), 200
+
+
 @admin_bp.route('/transactions')
 @admin_required
 def transactions():
     """View all transactions"""
     mongo = current_app.mongo
-    page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '').strip()
     per_page = 20
     
-    skip = (page - 1) * per_page
+    # Keyset cursor: issue_date and _id of the last row on the previous page
+    after_date, after_id = transaction_cursor(request.args)
     
     transactions_list = Transaction.get_all_transactions(
         mongo,
         status=status_filter if status_filter else None,
-        skip=skip,
-        limit=per_page
+        limit=per_page,
+        after_date=after_date,
+        after_id=after_id
     )
     
     total_transactions = Transaction.count_transactions(
@@ -318,13 +362,12 @@ def transactions():
         status=status_filter if status_filter else None
     )
     
-    total_pages = (total_transactions + per_page - 1) // per_page
+    next_cursor = next_transaction_cursor(transactions_list, per_page)
     
     return render_template(
         'admin/transactions.html',
         transactions=transactions_list,
-        page=page,
-        total_pages=total_pages,
+        next_cursor=next_cursor,
         total_transactions=total_transactions,
         status_filter=status_filter
     )
@@ -355,9 +398,19 @@ def return_book(transaction_id):
 @admin_required
 def overdue_books():
     """View overdue books"""
-    overdue_transactions = Transaction.get_overdue_transactions(current_app.mongo)
+    mongo = current_app.mongo
+    page = request.args.get('page', 1, type=int)
+    per_page = 50
+    
+    skip = (page - 1) * per_page
+    overdue_transactions = Transaction.get_overdue_transactions(mongo, skip=skip, limit=per_page)
+    total_overdue = Transaction.count_overdue(mongo)
+    total_pages = (total_overdue + per_page - 1) // per_page
     
     return render_template(
         'admin/overdue_books.html',
-        transactions=overdue_transactions
+        transactions=overdue_transactions,
+        page=page,
+        total_pages=total_pages,
+        total_overdue=total_overdue
     )
\ No newline at end of file
@@ -2,7 +2,7 @@
 Authentication Routes - Login, Logout, Registration
 """
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app
-from models.user import User
+from models.user import User, MAX_PASSWORD_BYTES, password_too_long
 from functools import wraps
 
 auth_bp = Blueprint('auth', __name__)
@@ -23,10 +23,12 @@ def admin_required(f):
     """Decorator to require admin role"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        # Resolve the session proxy once for both checks
+        current_session = session._get_current_object()
+        if 'user_id' not in current_session:
             flash('Please login to access this page', 'warning')
             return redirect(url_for('auth.login'))
-        if session.get('role') != 'admin':
+        if current_session.get('role') != 'admin':
             flash('Admin access required', 'danger')
             return redirect(url_for('user.dashboard'))
         return f(*args, **kwargs)
@@ -56,12 +58,14 @@ def login():
         
         if user:
             # Set session
-            session.permanent = True if remember else False
-            session['user_id'] = str(user['_id'])
-            session['username'] = user['username']
-            session['full_name'] = user['full_name']
-            session['role'] = user['role']
-            session['email'] = user['email']
+            session.permanent = bool(remember)
+            session.update({
+                'user_id': str(user['_id']),
+                'username': user['username'],
+                'full_name': user['full_name'],
+                'role': user['role'],
+                'email': user['email']
+            })
             
             flash(f'Welcome back, {user["full_name"]}!', 'success')
             
@@ -102,6 +106,8 @@ def register():
         
         if not password or len(password) < 6:
             errors.append('Password must be at least 6 characters long')
+        elif password_too_long(password):
+            errors.append(f'Password must be at most {MAX_PASSWORD_BYTES} bytes long')
         
         if password != confirm_password:
             errors.append('Passwords do not match')
@@ -160,7 +166,8 @@ def profile():
 @login_required
 def edit_profile():
     """Edit user profile"""
-    user = User.get_by_id(current_app.mongo, session['user_id'])
+    mongo = current_app.mongo
+    user = User.get_by_id(mongo, session['user_id'])
     if not user:
         flash('User not found', 'danger')
         return redirect(url_for('index'))
@@ -180,7 +187,7 @@ def edit_profile():
             'address': address
         }
         
-        if User.update_user(current_app.mongo, session['user_id'], update_data):
+        if User.update_user(mongo, session['user_id'], update_data):
             session['full_name'] = full_name
             flash('Profile updated successfully', 'success')
             return redirect(url_for('auth.profile'))
@@ -199,9 +206,11 @@ def change_password():
         new_password = request.form.get('new_password', '')
         confirm_password = request.form.get('confirm_password', '')
         
+        mongo = current_app.mongo
+        
         # Validate current password
-        user = User.get_by_id(current_app.mongo, session['user_id'])
-        if not User.authenticate(current_app.mongo, user['username'], current_password):
+        user = User.get_by_id(mongo, session['user_id'], fields={'password': 1})
+        if not user or not User.verify_password(user, current_password):
             flash('Current password is incorrect', 'danger')
             return render_template('auth/change_password.html')
         
@@ -210,12 +219,16 @@ def change_password():
             flash('New password must be at least 6 characters long', 'danger')
             return render_template('auth/change_password.html')
         
+        if password_too_long(new_password):
+            flash(f'New password must be at most {MAX_PASSWORD_BYTES} bytes long', 'danger')
+            return render_template('auth/change_password.html')
+        
         if new_password != confirm_password:
             flash('New passwords do not match', 'danger')
             return render_template('auth/change_password.html')
         
         # Change password
-        if User.change_password(current_app.mongo, session['user_id'], new_password):
+        if User.change_password(mongo, session['user_id'], new_password):
             flash('Password changed successfully', 'success')
             return redirect(url_for('auth.profile'))
         else:
@@ -1,199 +1,224 @@
 """
 Books API Routes - RESTful API endpoints for book operations
 """
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, request, current_app
 from models.book import Book
 from models.transaction import Transaction
-from bson.objectid import ObjectId
-import json
+from models.user import User
+from routes.pagination import book_cursor, next_book_cursor
+from extensions import cache, query_executor
+from config import Config
+import orjson
 
 books_bp = Blueprint('books', __name__)
 
 
-class JSONEncoder(json.JSONEncoder):
-    """Custom JSON encoder for MongoDB ObjectId"""
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        return super(JSONEncoder, self).default(obj)
+def _json_response(payload, status=200):
+    """Serialise a payload holding Mongo documents (read through mongo_json) in a single pass"""
+    return current_app.response_class(
+        orjson.dumps(payload),
+        status=status,
+        mimetype='application/json'
+    )
+
+
+def _stream_books_response(books, **data):
+    """Stream a success envelope, encoding book rows as the cursor yields them
+    
+    data holds the remaining metadata keys written after the books array.
+    The first row is read before the response is returned, so the query runs
+    (and can fail) inside the caller's error handling rather than after the
+    200 status has gone out; with batch_size equal to the page limit the
+    whole page arrives in that first batch.
+    """
+    rows = iter(books)
+    first = next(rows, None)
+    
+    def generate():
+        yield b'{"status":"success","data":{"books":['
+        if first is not None:
+            yield orjson.dumps(first)
+            for book in rows:
+                yield b',' + orjson.dumps(book)
+        yield b'],' + orjson.dumps(data)[1:] + b'}'
+    
+    return current_app.response_class(generate(), mimetype='application/json')
 
 
 @books_bp.route('/api/books', methods=['GET'])
 def get_books():
     """GET /books/api/books - Get all books with optional filters"""
     try:
-        mongo = current_app.mongo
+        mongo = current_app.mongo_json
         search = request.args.get('search', '').strip()
         category = request.args.get('category', '').strip()
         page = request.args.get('page', 1, type=int)
         limit = request.args.get('limit', 12, type=int)
         
-        skip = (page - 1) * limit
-        
         if search or category:
-            books = Book.search_books(mongo, search, category, skip, limit)
-            total = Book.count_books(mongo, search, category)
-        else:
-            books = Book.get_all_books(mongo, skip, limit)
-            total = Book.count_books(mongo)
-        
-        # Convert ObjectId to string
-        books_list = json.loads(JSONEncoder().encode(books))
-        
-        return jsonify({
-            'status': 'success',
-            'data': {
-                'books': books_list,
+            # Relevance-ranked results keep page numbers
+            books, total = Book.search_books_paged(mongo, search, category, (page - 1) * limit, limit)
+            data = {
+                'books': books,
                 'total': total,
                 'page': page,
                 'limit': limit,
                 'total_pages': (total + limit - 1) // limit
             }
-        }), 200
+        else:
+            # Unfiltered listings page with ?after=<next_cursor>; page is not used
+            # here, so no page numbers are reported for it
+            books = Book.get_books_after(mongo, book_cursor(request.args), limit)
+            cursor = next_book_cursor(books, limit)
+            data = {
+                'books': books,
+                'total': Book.count_books(mongo),
+                'limit': limit,
+                'next_cursor': cursor['after'] if cursor else None
+            }
+        
+        return _json_response({
+            'status': 'success',
+            'data': data
+        })
     except Exception as e:
-        return jsonify({
+        return _json_response({
             'status': 'error',
             'message': str(e)
-        }), 500
+        }, 500)
 
 
 @books_bp.route('/api/books/<book_id>', methods=['GET'])
 def get_book(book_id):
     """GET /books/api/books/<book_id> - Get single book by ID"""
     try:
-        book = Book.get_by_id(current_app.mongo, book_id)
+        mongo = current_app.mongo_json
+        book = Book.get_by_id(mongo, book_id)
         
         if not book:
-            return jsonify({
+            return _json_response({
                 'status': 'error',
                 'message': 'Book not found'
-            }), 404
-        
-        book_data = json.loads(JSONEncoder().encode(book))
+            }, 404)
         
-        return jsonify({
+        return _json_response({
             'status': 'success',
-            'data': book_data
-        }), 200
+            'data': book
+        })
     except Exception as e:
-        return jsonify({
+        return _json_response({
             'status': 'error',
             'message': str(e)
-        }), 500
+        }, 500)
 
 
 @books_bp.route('/api/books/search', methods=['GET'])
 def search_books():
     """GET /books/api/books/search - Search books by query"""
     try:
-        mongo = current_app.mongo
+        mongo = current_app.mongo_json
         query = request.args.get('q', '').strip()
         category = request.args.get('category', '').strip()
         
         if not query:
-            return jsonify({
+            return _json_response({
                 'status': 'error',
                 'message': 'Search query is required'
-            }), 400
+            }, 400)
         
+        # Searches are cached, so repeated misses (typos) don't reach Mongo again;
+        # only a count of the returned rows is reported, so no total is computed
         books = Book.search_books(mongo, query, category, limit=50)
-        books_list = json.loads(JSONEncoder().encode(books))
         
-        return jsonify({
+        return _json_response({
             'status': 'success',
             'data': {
-                'books': books_list,
-                'count': len(books_list)
+                'books': books,
+                'count': len(books)
             }
-        }), 200
+        })
     except Exception as e:
-        return jsonify({
+        return _json_response({
             'status': 'error',
             'message': str(e)
-        }), 500
+        }, 500)
 
 
 @books_bp.route('/api/categories', methods=['GET'])
 def get_categories():
     """GET /books/api/categories - Get all book categories"""
     try:
-        categories = Book.get_categories(current_app.mongo)
+        mongo = current_app.mongo
+        categories = Book.get_categories(mongo)
         
-        return jsonify({
+        return _json_response({
             'status': 'success',
             'data': {
                 'categories': categories,
                 'count': len(categories)
             }
-        }), 200
+        })
     except Exception as e:
-        return jsonify({
+        return _json_response({
             'status': 'error',
             'message': str(e)
-        }), 500
+        }, 500)
 
 
 @books_bp.route('/api/books/available', methods=['GET'])
 def get_available_books():
     """GET /books/api/books/available - Get all available books"""
     try:
-        mongo = current_app.mongo
+        mongo = current_app.mongo_json
         page = request.args.get('page', 1, type=int)
         limit = request.args.get('limit', 12, type=int)
         
         skip = (page - 1) * limit
         books = Book.get_available_books(mongo, skip, limit)
         
-        total = mongo.db.books.count_documents({
-            'is_active': True,
-            'available_quantity': {'$gt': 0}
-        })
-        
-        books_list = json.loads(JSONEncoder().encode(books))
+        total = Book.count_available_books(mongo)
         
-        return jsonify({
-            'status': 'success',
-            'data': {
-                'books': books_list,
-                'total': total,
-                'page': page,
-                'limit': limit
-            }
-        }), 200
+        # Rows are encoded while the cursor is read rather than collected first
+        return _stream_books_response(books, total=total, page=page, limit=limit)
     except Exception as e:
-        return jsonify({
+        return _json_response({
             'status': 'error',
             'message': str(e)
-        }), 500
+        }, 500)
 
 
 @books_bp.route('/api/statistics', methods=['GET'])
+@cache.cached(timeout=Config.STATISTICS_CACHE_TIMEOUT, response_filter=lambda response: response.status_code == 200)
 def get_statistics():
     """GET /books/api/statistics - Get library statistics"""
     try:
         mongo = current_app.mongo
         
+        # Run the independent counts concurrently on the shared query pool
+        inventory_future = query_executor.submit(Book.get_inventory_stats, mongo)
+        issued_future = query_executor.submit(Transaction.count_transactions, mongo, status='issued')
+        users_future = query_executor.submit(User.count_users, mongo, role='user')
+        overdue_future = query_executor.submit(Transaction.count_overdue, mongo)
+        
+        # Categories come from the app cache, which needs the request's app context
+        total_categories = len(Book.get_categories(mongo))
+        
+        inventory = inventory_future.result()
         stats = {
-            'total_books': Book.count_books(mongo),
-            'total_categories': len(Book.get_categories(mongo)),
-            'issued_books': Transaction.count_transactions(mongo, status='issued'),
-            'available_books': mongo.db.books.aggregate([
-                {'$match': {'is_active': True}},
-                {'$group': {'_id': None, 'total': {'$sum': '$available_quantity'}}}
-            ]),
-            'total_users': mongo.db.users.count_documents({'role': 'user'}),
-            'overdue_books': len(Transaction.get_overdue_transactions(mongo))
+            'total_books': inventory['total_books'],
+            'total_categories': total_categories,
+            'issued_books': issued_future.result(),
+            'available_books': inventory['available_books'],
+            'total_users': users_future.result(),
+            'overdue_books': overdue_future.result()
         }
         
-        available = list(stats['available_books'])
-        stats['available_books'] = available[0]['total'] if available else 0
-        
-        return jsonify({
+        return _json_response({
             'status': 'success',
             'data': stats
-        }), 200
+        })
     except Exception as e:
-        return jsonify({
+        return _json_response({
             'status': 'error',
             'message': str(e)
-        }), 500
\ No newline at end of file
+        }, 500)
\ No newline at end of file
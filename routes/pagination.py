@@ -0,0 +1,43 @@
+"""
+Keyset pagination helpers - Read and build "next page" cursors for list routes
+"""
+from bson.objectid import ObjectId
+from datetime import datetime
+
+
+def transaction_cursor(args):
+    """Read the issue_date/_id of the previous page's last transaction from request args"""
+    after_date = args.get('after_date', '').strip()
+    after_id = args.get('after_id', '').strip()
+    try:
+        after_date = datetime.fromisoformat(after_date) if after_date else None
+    except ValueError:
+        after_date = None
+    
+    if not after_date or not ObjectId.is_valid(after_id):
+        return None, None
+    return after_date, after_id
+
+
+def next_transaction_cursor(transactions, per_page):
+    """URL args for the page after a full page of transactions, else None"""
+    if len(transactions) < per_page:
+        return None
+    last = transactions[-1]
+    return {
+        'after_date': last['issue_date'].isoformat(),
+        'after_id': str(last['_id'])
+    }
+
+
+def book_cursor(args):
+    """Read the _id of the previous page's last book from request args"""
+    after = args.get('after', '').strip()
+    return after if ObjectId.is_valid(after) else None
+
+
+def next_book_cursor(books, per_page):
+    """URL args for the page after a full page of books, else None"""
+    if len(books) < per_page:
+        return None
+    return {'after': str(books[-1]['_id'])}
@@ -1,11 +1,14 @@
 """
 User Routes - User dashboard and book browsing
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, session, make_response
 from routes.auth import login_required
+from routes.pagination import book_cursor, next_book_cursor, transaction_cursor, next_transaction_cursor
 from models.book import Book
 from models.transaction import Transaction
 from models.user import User
+from extensions import cache, query_executor
+from config import Config
 
 user_bp = Blueprint('user', __name__)
 
@@ -15,23 +18,23 @@ user_bp = Blueprint('user', __name__)
 def dashboard():
     """User dashboard"""
     mongo = current_app.mongo
+    user_id = session['user_id']
     
-    # Get user's issued books
-    issued_books = Transaction.get_user_transactions(
-        mongo,
-        user_id=session['user_id'],
-        status='issued',
-        limit=10
+    # Issue the three independent queries concurrently instead of one after another
+    issued_future = query_executor.submit(Transaction.get_issued_with_fines, mongo, user_id, limit=10)
+    user_future = query_executor.submit(User.get_by_id, mongo, user_id)
+    recent_future = query_executor.submit(
+        lambda: list(Book.get_all_books(mongo, limit=6, fields={'title': 1, 'author': 1}))
     )
     
-    # Get user details
-    user = User.get_by_id(mongo, session['user_id'])
+    # Get user's issued books and the fines pending on all of them
+    issued_books, total_fines = issued_future.result()
     
-    # Calculate total current fines
-    total_fines = sum(book.get('current_fine', 0) for book in issued_books)
+    # Get user details
+    user = user_future.result()
     
     # Get recently added books
-    recent_books = Book.get_all_books(mongo, limit=6)
+    recent_books = recent_future.result()
     
     return render_template(
         'user/dashboard.html',
@@ -52,48 +55,57 @@ def browse_books():
     search_query = request.args.get('search', '').strip()
     category = request.args.get('category', '').strip()
     
-    skip = (page - 1) * per_page
-    
-    if search_query or category:
-        books_list = Book.search_books(mongo, search_query, category, skip, per_page)
-        total_books = Book.count_books(mongo, search_query, category)
-    else:
-        books_list = Book.get_all_books(mongo, skip, per_page)
-        total_books = Book.count_books(mongo)
+    after = book_cursor(request.args)
+    
+    # The book grid is the same for every user, so its rendered HTML is cached;
+    # the surrounding page carries per-user navigation and is rendered each time
+    grid_key = Book.cache_key('html:browse', search_query, category, page, after)
+    grid = cache.get(grid_key)
+    if grid is None:
+        next_cursor = None
+        if search_query or category:
+            # Relevance-ranked results keep page numbers
+            books_list = Book.search_books(mongo, search_query, category, (page - 1) * per_page, per_page)
+        else:
+            books_list = Book.get_books_after(mongo, after, per_page)
+            next_cursor = next_book_cursor(books_list, per_page)
+        
+        grid = {
+            'html': render_template('user/_book_grid.html', books=books_list),
+            'next_cursor': next_cursor
+        }
+        cache.set(grid_key, grid, timeout=Config.BROWSE_CACHE_TIMEOUT)
     
-    total_pages = (total_books + per_page - 1) // per_page
     categories = Book.get_categories(mongo)
     
-    return render_template(
+    response = make_response(render_template(
         'user/browse_books.html',
-        books=books_list,
-        page=page,
-        total_pages=total_pages,
-        total_books=total_books,
+        book_grid=grid['html'],
+        next_cursor=grid['next_cursor'],
         categories=categories,
         search_query=search_query,
         selected_category=category
-    )
+    ))
+    
+    # Let the browser revalidate its private copy and get a 304 when nothing changed
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @user_bp.route('/book/<book_id>')
 @login_required
 def book_details(book_id):
     """View book details"""
-    book = Book.get_by_id(current_app.mongo, book_id)
+    mongo = current_app.mongo
+    book = Book.get_by_id(mongo, book_id)
     
     if not book:
         flash('Book not found', 'danger')
         return redirect(url_for('user.browse_books'))
     
     # Check if user has already issued this book
-    user_issued_books = Transaction.get_user_transactions(
-        current_app.mongo,
-        user_id=session['user_id'],
-        status='issued'
-    )
-    
-    already_issued = any(str(b['book_id']) == book_id for b in user_issued_books)
+    already_issued = Transaction.user_has_issued(mongo, session['user_id'], book['_id'])
     
     return render_template(
         'user/book_details.html',
@@ -107,17 +119,16 @@ def book_details(book_id):
 def my_books():
     """View user's issued books"""
     mongo = current_app.mongo
-    page = request.args.get('page', 1, type=int)
     per_page = 10
+    after_date, after_id = transaction_cursor(request.args)
     
-    skip = (page - 1) * per_page
-    
-    issued_books = Transaction.get_user_transactions(
+    # The page, plus the fines pending across every issued book (not just this page)
+    issued_books, total_fines = Transaction.get_issued_with_fines(
         mongo,
-        user_id=session['user_id'],
-        status='issued',
-        skip=skip,
-        limit=per_page
+        session['user_id'],
+        limit=per_page,
+        after_date=after_date,
+        after_id=after_id
     )
     
     total_transactions = Transaction.count_transactions(
@@ -126,16 +137,11 @@ def my_books():
         status='issued'
     )
     
-    total_pages = (total_transactions + per_page - 1) // per_page
-    
-    # Calculate total fines
-    total_fines = sum(book.get('current_fine', 0) for book in issued_books)
-    
     return render_template(
         'user/my_books.html',
         issued_books=issued_books,
-        page=page,
-        total_pages=total_pages,
+        next_cursor=next_transaction_cursor(issued_books, per_page),
+        total_transactions=total_transactions,
         total_fines=total_fines
     )
 
@@ -145,16 +151,15 @@ def my_books():
 def history():
     """View user's borrowing history"""
     mongo = current_app.mongo
-    page = request.args.get('page', 1, type=int)
     per_page = 20
-    
-    skip = (page - 1) * per_page
+    after_date, after_id = transaction_cursor(request.args)
     
     transactions = Transaction.get_user_transactions(
         mongo,
         user_id=session['user_id'],
-        skip=skip,
-        limit=per_page
+        limit=per_page,
+        after_date=after_date,
+        after_id=after_id
     )
     
     total_transactions = Transaction.count_transactions(
@@ -162,12 +167,9 @@ def history():
         user_id=session['user_id']
     )
     
-    total_pages = (total_transactions + per_page - 1) // per_page
-    
     return render_template(
         'user/history.html',
         transactions=transactions,
-        page=page,
-        total_pages=total_pages,
+        next_cursor=next_transaction_cursor(transactions, per_page),
         total_transactions=total_transactions
     )
\ No newline at end of file